@@ -1,12 +1,14 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
 import re
-import networkx as nx
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 import pickle
 import numpy as np
+from contact_graph import ContactGraph
+from confidence_table import ConfidenceTable, TABLE_PATH, model_digest
 
 load_dotenv()
 
@@ -18,9 +20,11 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
-# Load the trained model
+# Load the trained model and, if it was compiled from this model, its lookup table
 with open('contact_model.pkl', 'rb') as f:
-    CONTACT_MODEL = pickle.load(f)
+    model_bytes = f.read()
+CONTACT_MODEL = pickle.loads(model_bytes)
+CONFIDENCE_TABLE = ConfidenceTable.load(TABLE_PATH, model_digest(model_bytes))
 
 
 class Individual(db.Model):
@@ -38,6 +42,95 @@ class Contact(db.Model):
     contact_date = db.Column(db.Date, nullable=False)
 
 
+class ContactStats(db.Model):
+    __tablename__ = 'contact_stats'
+    individual_id = db.Column(db.Integer, db.ForeignKey('individuals.id'), primary_key=True)
+    degree = db.Column(db.Integer, nullable=False, default=0)
+    last_contact_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+def refresh_contact_stats(person_ids=None):
+    """Recompute degree and last contact date for the given people (everyone if None) in the current transaction."""
+    pairs = db.union_all(
+        db.select(Contact.individual_id.label('person'), Contact.contact_id.label('other'), Contact.contact_date),
+        db.select(Contact.contact_id, Contact.individual_id, Contact.contact_date)
+    ).subquery()
+    stats = db.select(pairs.c.person, db.func.count(db.distinct(pairs.c.other)), db.func.max(pairs.c.contact_date),
+                      db.func.now())
+    if person_ids is not None:
+        stats = stats.where(pairs.c.person.in_(person_ids))
+    stmt = insert(ContactStats).from_select(
+        ['individual_id', 'degree', 'last_contact_date', 'updated_at'], stats.group_by(pairs.c.person))
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ContactStats.individual_id],
+        set_={'degree': stmt.excluded.degree, 'last_contact_date': stmt.excluded.last_contact_date,
+              'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the contact_stats table from every logged contact."""
+    refresh_contact_stats()
+    count = ContactStats.query.count()
+    db.session.commit()
+    print(f"Contact stats rebuilt for {count} people")
+
+
+# In-memory contact network shared by every request in this process
+contact_graph = ContactGraph()
+
+
+@db.event.listens_for(db.metadata, 'after_create')
+@db.event.listens_for(db.metadata, 'after_drop')
+def reset_contact_graph(*args, **kwargs):
+    contact_graph.clear()
+
+
+def sync_contact_graph(full=False):
+    """Replay rows newer than the last ones seen (e.g. written by another worker); full=True reloads everything."""
+    if full:
+        contact_graph.clear()
+    people = db.session.query(Individual.id, Individual.unique_id) \
+        .filter(Individual.id > contact_graph.person_high_water).order_by(Individual.id)
+    contacts = db.session.query(Contact.id, Contact.individual_id, Contact.contact_id, Contact.contact_date) \
+        .filter(Contact.id > contact_graph.contact_high_water).order_by(Contact.id)
+    contact_graph.replay(people, contacts)
+
+
+@app.cli.command('resync-graph')
+def resync_graph_command():
+    """Rebuild the in-memory contact graph from the database."""
+    sync_contact_graph(full=True)
+    print(f"Contact graph loaded: {len(contact_graph.unique_ids)} people, "
+          f"contacts up to id {contact_graph.contact_high_water}")
+
+
+def candidate_features(person_id, today):
+    """Second-degree (neighbor, candidate) pairs for a person and their model features, one row per pair."""
+    neighbors = contact_graph.neighbors(person_id)
+    direct_ids = set(neighbors)
+    pairs = [(n, s) for n in neighbors for s in contact_graph.neighbors(n) if s != person_id and s not in direct_ids]
+    if not pairs:
+        return pairs, np.empty((0, 3), dtype=int)
+    # Features for AI: [neighbor_contacts, days_ago, mutual_contacts], each computed once per person
+    neighbor_features = {n: (contact_graph.degree(n), (today - contact_graph.last_contact[n]).days)
+                         for n in direct_ids}
+    mutuals = {s: len(direct_ids.intersection(contact_graph.neighbors(s))) for _, s in pairs}
+    features = np.empty((len(pairs), 3), dtype=int)
+    features[:, :2] = [neighbor_features[n] for n, _ in pairs]
+    features[:, 2] = [mutuals[s] for _, s in pairs]
+    return pairs, features
+
+
+def score_features(features):
+    """Contact probability per feature row, from the lookup table when it covers the rows."""
+    if CONFIDENCE_TABLE is not None and np.issubdtype(features.dtype, np.integer):
+        return CONFIDENCE_TABLE.lookup(features)
+    return CONTACT_MODEL.predict_proba(features)[:, 1]
+
+
 @app.route('/add_person', methods=['POST'])
 def add_person():
     data = request.json
@@ -53,6 +146,8 @@ def add_person():
     db.session.add(person)
     try:
         db.session.commit()
+        if contact_graph.loaded:
+            contact_graph.add_person(person.id, person.unique_id)
         return jsonify({'id': person.id}), 201
     except Exception as e:
         db.session.rollback()
@@ -78,7 +173,11 @@ def add_contact():
                       contact_date=data['contact_date'])
     db.session.add(contact)
     try:
+        db.session.flush()
+        refresh_contact_stats([contact.individual_id, contact.contact_id])
         db.session.commit()
+        if contact_graph.loaded:
+            contact_graph.add_contact(contact.individual_id, contact.contact_id, contact.contact_date)
         return jsonify({'id': contact.id}), 201
     except Exception as e:
         db.session.rollback()
@@ -92,7 +191,10 @@ def get_person(unique_id):
     person = Individual.query.filter_by(unique_id=unique_id).first()
     if not person:
         return jsonify({'error': 'No person found with that ID'}), 404
-    return jsonify({'id': person.id, 'unique_id': person.unique_id, 'phone_number': person.phone_number}), 200
+    stats = db.session.get(ContactStats, person.id)
+    return jsonify({'id': person.id, 'unique_id': person.unique_id, 'phone_number': person.phone_number,
+                    'contacts': stats.degree if stats else 0,
+                    'last_contact_date': str(stats.last_contact_date) if stats else None}), 200
 
 
 @app.route('/contacts/<unique_id>', methods=['GET'])
@@ -101,11 +203,8 @@ def get_contacts(unique_id):
     if not person:
         return jsonify({'error': 'No person found with that ID'}), 404
 
-    G = nx.Graph()
-    all_contacts = Contact.query.all()
-    individuals = {i.id: i.unique_id for i in Individual.query.all()}
-    for c in all_contacts:
-        G.add_edge(individuals[c.individual_id], individuals[c.contact_id], date=str(c.contact_date))
+    sync_contact_graph()
+    individuals = contact_graph.unique_ids
 
     direct_outgoing = Contact.query.filter_by(individual_id=person.id).all()
     direct_incoming = Contact.query.filter_by(contact_id=person.id).all()
@@ -116,37 +215,25 @@ def get_contacts(unique_id):
 
     predicted = {}
     explanations = {}
-    if person.unique_id in G:
-        today = datetime.now().date()
-        direct_uids = [individuals[c.contact_id] if c.individual_id == person.id else individuals[c.individual_id]
-                       for c in direct_contacts]
-        for neighbor in G.neighbors(person.unique_id):
-            for second_neighbor in G.neighbors(neighbor):
-                if second_neighbor != person.unique_id and second_neighbor not in direct_uids:
-                    # Features for AI: [neighbor_contacts, days_ago, mutual_contacts]
-                    neighbor_contacts = len(list(G.neighbors(neighbor)))
-                    contact_dates = [c.contact_date for c in all_contacts if
-                                     individuals[c.individual_id] == neighbor or individuals[c.contact_id] == neighbor]
-                    days_ago = min([(today - d).days for d in contact_dates], default=30)
-                    mutual_contacts = len(set(G.neighbors(person.unique_id)) & set(G.neighbors(second_neighbor)))
-                    features = np.array([[neighbor_contacts, days_ago, mutual_contacts]])
-                    confidence = CONTACT_MODEL.predict_proba(features)[0][1]
-                    explanation = (
-                        f"Predicted {second_neighbor} via {neighbor}: "
-                        f"Contacts={neighbor_contacts} (high activity boosts chance), "
-                        f"Days ago={days_ago} (recent is better), "
-                        f"Mutuals={mutual_contacts} (shared ties help),  "
-                        f"Confidence={confidence:.2f}"
-                    )
-                    print(explanation)
-                    predicted[second_neighbor] = round(confidence, 2)
-                    explanations[second_neighbor] = explanation
-
-    nodes = [{'id': i.id, 'unique_id': i.unique_id,
-              'contacts': len(list(G.neighbors(i.unique_id))) if i.unique_id in G else 0}
-             for i in Individual.query.all()]
-    edges = [{'source': individuals[c.individual_id], 'target': individuals[c.contact_id], 'date': str(c.contact_date)}
-             for c in all_contacts]
+    pairs, features = candidate_features(person.id, datetime.now().date())
+    if len(pairs):
+        confidences = score_features(features)
+        for (neighbor, second_neighbor), (neighbor_contacts, days_ago, mutual_contacts), confidence in zip(
+                pairs, features.tolist(), confidences):
+            explanation = (
+                f"Predicted {individuals[second_neighbor]} via {individuals[neighbor]}: "
+                f"Contacts={neighbor_contacts} (high activity boosts chance), "
+                f"Days ago={days_ago} (recent is better), "
+                f"Mutuals={mutual_contacts} (shared ties help),  "
+                f"Confidence={confidence:.2f}"
+            )
+            print(explanation)
+            predicted[individuals[second_neighbor]] = round(confidence, 2)
+            explanations[individuals[second_neighbor]] = explanation
+
+    nodes = [{'id': i, 'unique_id': uid, 'contacts': contact_graph.degree(i)} for i, uid in individuals.items()]
+    edges = [{'source': individuals[a], 'target': individuals[b], 'date': str(d)}
+             for a, neighbours in contact_graph.adjacency.items() for b, d in neighbours.items() if a < b]
 
     return jsonify({
         'direct': direct,
@@ -159,4 +246,5 @@ def get_contacts(unique_id):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        sync_contact_graph(full=True)
     app.run(debug=True)
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import numpy as np
+
+TABLE_PATH = 'contact_model_table.npz'
+
+# Feature ranges produced by training_data.py: [direct_contacts, days_since_last, mutual_contacts]
+FEATURE_RANGES = ((0, 10), (0, 30), (0, 5))
+
+
+def model_digest(model_bytes):
+    return hashlib.sha256(model_bytes).hexdigest()
+
+
+def feature_bounds(model):
+    """Integer bounds per feature that contain the training ranges and every split threshold of the forest.
+
+    Trees split on `x <= threshold`, so any value below the lower bound takes the same path as the lower
+    bound and any value above the upper bound the same path as the upper bound. Clamping features into
+    these bounds therefore never changes a prediction.
+    """
+    low = np.array([r[0] for r in FEATURE_RANGES])
+    high = np.array([r[1] for r in FEATURE_RANGES])
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        for f in range(len(FEATURE_RANGES)):
+            thresholds = tree.threshold[tree.feature == f]
+            if len(thresholds):
+                low[f] = min(low[f], np.floor(thresholds.min()))
+                high[f] = max(high[f], np.floor(thresholds.max()) + 1)
+    return low, high
+
+
+class ConfidenceTable:
+    """Contact probability for every integer feature combination, indexed as table[contacts, days, mutuals]."""
+
+    def __init__(self, table, low, digest):
+        self.table = table
+        self.low = low
+        self.high = low + np.array(table.shape) - 1
+        self.digest = digest
+
+    @classmethod
+    def build(cls, model, digest):
+        low, high = feature_bounds(model)
+        shape = tuple(high - low + 1)
+        grid = np.indices(shape).reshape(len(shape), -1).T + low
+        table = model.predict_proba(grid)[:, 1].reshape(shape)
+        return cls(table, low, digest)
+
+    def save(self, path=TABLE_PATH):
+        np.savez(path, table=self.table, low=self.low, digest=self.digest)
+
+    @classmethod
+    def load(cls, path, digest):
+        """The saved table, or None if it is missing or was compiled from a different model."""
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if str(data['digest']) != digest:
+            return None
+        return cls(data['table'], data['low'], digest)
+
+    def lookup(self, features):
+        index = np.clip(features, self.low, self.high) - self.low
+        return self.table[index[:, 0], index[:, 1], index[:, 2]]
@@ -0,0 +1,55 @@
+import threading
+
+
+class ContactGraph:
+    """Process-wide adjacency index of the contact network, keyed by individual id.
+
+    Each pair of people is stored once per direction with the most recent date they met,
+    so replaying a contact row that is already in the index is harmless.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.loaded = False
+            self.person_high_water = 0
+            self.contact_high_water = 0
+            self.unique_ids = {}
+            self.adjacency = {}
+            self.last_contact = {}
+
+    def add_person(self, person_id, unique_id):
+        with self._lock:
+            self.unique_ids[person_id] = unique_id
+            self.adjacency.setdefault(person_id, {})
+
+    def add_contact(self, individual_id, contact_id, contact_date):
+        with self._lock:
+            for a, b in ((individual_id, contact_id), (contact_id, individual_id)):
+                neighbours = self.adjacency.setdefault(a, {})
+                if b not in neighbours or neighbours[b] < contact_date:
+                    neighbours[b] = contact_date
+                if a not in self.last_contact or self.last_contact[a] < contact_date:
+                    self.last_contact[a] = contact_date
+
+    def replay(self, people, contacts):
+        """Apply (id, unique_id) and (id, individual_id, contact_id, contact_date) rows read from the database."""
+        for person_id, unique_id in people:
+            self.add_person(person_id, unique_id)
+            self.person_high_water = max(self.person_high_water, person_id)
+        for row_id, individual_id, contact_id, contact_date in contacts:
+            self.add_contact(individual_id, contact_id, contact_date)
+            self.contact_high_water = max(self.contact_high_water, row_id)
+        self.loaded = True
+
+    def neighbors(self, person_id):
+        return list(self.adjacency.get(person_id, ()))
+
+    def degree(self, person_id):
+        return len(self.adjacency.get(person_id, ()))
+
+    def __contains__(self, person_id):
+        return bool(self.adjacency.get(person_id))
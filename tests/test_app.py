@@ -1,5 +1,9 @@
 import pytest
-from app import app, db
+from datetime import date
+from app import app, db, CONTACT_MODEL, ContactStats, candidate_features, contact_graph
+from contact_graph import ContactGraph
+from confidence_table import ConfidenceTable
+import numpy as np
 from ui import generate_explanation
 import os
 
@@ -75,6 +79,89 @@ def test_low_confidence_prediction(client):
     assert data['predicted'][0]['confidence'] < 0.5
 
 
+def test_contact_graph_updates_after_trace(client):
+    client.post('/add_person', json={'unique_id': 'user1', 'phone_number': '1234567890'})
+    client.post('/add_person', json={'unique_id': 'user2', 'phone_number': '9876543210'})
+    client.post('/add_contact', json={'individual_id': 1, 'contact_id': 2, 'contact_date': '2025-03-01'})
+    client.get('/contacts/user1')  # Loads the in-memory graph
+    client.post('/add_person', json={'unique_id': 'user3', 'phone_number': '5555555555'})
+    client.post('/add_contact', json={'individual_id': 2, 'contact_id': 3, 'contact_date': '2025-03-02'})
+    data = client.get('/contacts/user1').get_json()
+    assert [p['unique_id'] for p in data['predicted']] == ['user3']
+    assert len(data['graph']['edges']) == 2
+
+
+def test_contact_graph_replay_is_idempotent():
+    graph = ContactGraph()
+    rows = [(1, 1, 2, date(2025, 3, 1)), (2, 2, 1, date(2025, 3, 5))]
+    graph.replay([(1, 'user1'), (2, 'user2')], rows)
+    graph.replay([], rows)
+    assert graph.neighbors(1) == [2]
+    assert graph.degree(2) == 1
+    assert graph.last_contact[1] == date(2025, 3, 5)
+    assert graph.contact_high_water == 2
+
+
+def test_batched_scoring_matches_per_pair(client):
+    for i in range(1, 6):
+        client.post('/add_person', json={'unique_id': f'user{i}'})
+    for a, b, day in [(1, 2, '2025-03-01'), (2, 3, '2025-03-05'), (2, 4, '2025-03-06'), (1, 5, '2025-03-07'),
+                      (5, 4, '2025-03-08')]:
+        client.post('/add_contact', json={'individual_id': a, 'contact_id': b, 'contact_date': day})
+    data = client.get('/contacts/user1').get_json()
+    pairs, features = candidate_features(1, date(2025, 3, 10))
+    assert pairs == [(2, 3), (2, 4), (5, 4)]
+    assert features.tolist() == [[3, 4, 1], [3, 4, 2], [2, 2, 2]]
+    for row, confidence in zip(features, CONTACT_MODEL.predict_proba(features)[:, 1]):
+        assert CONTACT_MODEL.predict_proba(row.reshape(1, -1))[0][1] == confidence
+    assert [p['unique_id'] for p in data['predicted']] == ['user3', 'user4']
+    assert contact_graph.degree(2) == 3
+
+
+def test_confidence_table_matches_model():
+    table = ConfidenceTable.build(CONTACT_MODEL, 'test')
+    grid = np.indices(table.table.shape).reshape(3, -1).T + table.low
+    assert np.allclose(table.lookup(grid), CONTACT_MODEL.predict_proba(grid)[:, 1])
+    # Values outside the table are clamped without changing the prediction
+    outside = np.array([[50, 590, 9], [-1, -3, 0], [2, 400, 1]])
+    assert np.allclose(table.lookup(outside), CONTACT_MODEL.predict_proba(outside)[:, 1])
+
+
+def test_confidence_table_rejects_other_model(tmp_path):
+    path = str(tmp_path / 'table.npz')
+    ConfidenceTable.build(CONTACT_MODEL, 'old-model').save(path)
+    assert ConfidenceTable.load(path, 'old-model') is not None
+    assert ConfidenceTable.load(path, 'new-model') is None
+
+
+def test_contact_stats_maintained(client):
+    for i in range(1, 4):
+        client.post('/add_person', json={'unique_id': f'user{i}'})
+    client.post('/add_contact', json={'individual_id': 1, 'contact_id': 2, 'contact_date': '2025-03-01'})
+    client.post('/add_contact', json={'individual_id': 2, 'contact_id': 1, 'contact_date': '2025-03-04'})
+    client.post('/add_contact', json={'individual_id': 3, 'contact_id': 2, 'contact_date': '2025-03-02'})
+    data = client.get('/person/user2').get_json()
+    assert data['contacts'] == 2
+    assert data['last_contact_date'] == '2025-03-04'
+    assert client.get('/person/user3').get_json()['contacts'] == 1
+
+
+def test_rebuild_contact_stats(client):
+    for i in range(1, 4):
+        client.post('/add_person', json={'unique_id': f'user{i}'})
+    client.post('/add_contact', json={'individual_id': 1, 'contact_id': 2, 'contact_date': '2025-03-01'})
+    client.post('/add_contact', json={'individual_id': 1, 'contact_id': 3, 'contact_date': '2025-03-05'})
+    with app.app_context():
+        before = {s.individual_id: (s.degree, s.last_contact_date) for s in ContactStats.query.all()}
+        ContactStats.query.delete()
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['rebuild-stats'])
+    assert 'rebuilt for 3 people' in result.output
+    with app.app_context():
+        after = {s.individual_id: (s.degree, s.last_contact_date) for s in ContactStats.query.all()}
+    assert after == before == {1: (2, date(2025, 3, 5)), 2: (1, date(2025, 3, 1)), 3: (1, date(2025, 3, 5))}
+
+
 def test_generate_explanation_high_confidence():
     result = {}
     generate_explanation("user3", 0.85, 3, 0, 1, result)
@@ -3,6 +3,7 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.metrics import accuracy_score
 import pickle
+from confidence_table import ConfidenceTable, TABLE_PATH, model_digest
 
 # Load data
 data = np.load('contact_data.npz')
@@ -37,7 +38,13 @@ print("Feature importance:",
       dict(zip(['direct_contacts', 'days_since_last', 'mutual_contacts'], model.feature_importances_)))
 
 # Save
+model_bytes = pickle.dumps(model)
 with open('contact_model.pkl', 'wb') as f:  # type: BinaryIO
-    pickle.dump(model, f)
+    f.write(model_bytes)
 
 print("Model trained and saved as contact_model.pkl")
+
+# Compile every integer feature combination into a lookup table for app.py
+table = ConfidenceTable.build(model, model_digest(model_bytes))
+table.save(TABLE_PATH)
+print(f"Lookup table {table.table.shape} for features {table.low}..{table.high} saved as {TABLE_PATH}")